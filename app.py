@@ -1,18 +1,38 @@
 """Console application for browsing farmers markets, managing users, and working with reviews."""
 
+import codecs
 import csv
+import hashlib
+import heapq
+import hmac
 import json
+import mmap
+import os
+import pickle
+import re
+import secrets
 import shlex
 import string
-from datetime import datetime, timezone
-from math import atan2, cos, radians, sin, sqrt
+import sys
+import tempfile
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from math import asin, atan2, cos, pi, radians, sin, sqrt
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Callable
+from typing import Any, Callable, Iterator
 
-from argon2 import PasswordHasher
+from argon2 import Parameters, PasswordHasher, extract_parameters
 from argon2.exceptions import InvalidHashError, VerifyMismatchError
 from email_validator import EmailNotValidError, validate_email
 
+try:
+    import orjson
+except ImportError:  # optional: faster JSON encoding/decoding
+    orjson = None
+
 Market = dict[str, Any]
 Markets = dict[int, Market]
 User = dict[str, Any]
@@ -20,14 +40,61 @@ Review = dict[str, Any]
 CommandArgs = dict[str, str]
 AppState = dict[str, Any]
 
-ph = PasswordHasher()
+
+@dataclass(slots=True)
+class EnrichedMarket:
+    """A market together with display-only rating and distance data."""
+
+    market: Market
+    rating_count: int
+    rating_avg: float | None
+    distance: float | None
+
+
+class LazyState(dict):
+    """Application state whose data sets are loaded on first access.
+
+    loaders maps a state key to a function returning a group of related keys
+    (a data set and the indexes derived from it). When any key of the group is
+    missing, the whole group is loaded at once so the indexes stay consistent.
+    """
+
+    def __init__(self, loaders: dict[str, Callable[[], AppState]], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loaders = loaders
+
+    def __missing__(self, key: str) -> Any:
+        loader = self.loaders.get(key)
+        if loader is None:
+            raise KeyError(key)
+        self.update(loader())
+        return self[key]
+
+
+# Argon2id with the OWASP minimum profile (19 MiB, 2 iterations, 1 lane) instead of
+# the argon2-cffi defaults (64 MiB, 3 iterations, 4 lanes), so register/login do not
+# stall the REPL. Existing hashes are upgraded on the next successful login.
+ph = PasswordHasher(
+    time_cost=2, memory_cost=19 * 1024, parallelism=1, hash_len=32, salt_len=16
+)
 
 # Paths
 BASE_DIR = Path(__file__).resolve().parent
 DATA_PATH = BASE_DIR / "farmers_markets.csv"
+MARKETS_CACHE_PATH = BASE_DIR / "farmers_markets.cache.pkl"
 USERS_PATH = BASE_DIR / "users.json"
 REVIEWS_PATH = BASE_DIR / "reviews.json"
 
+# Read buffer for the markets CSV: the file is read sequentially from start to end
+CSV_READ_BUFFER = 1 << 20
+
+# CSV columns used by the application, in the order normalize_market() unpacks them
+MARKET_CSV_COLUMNS = ("FMID", "MarketName", "city", "State", "zip", "y", "x")
+
+# Bump when the cache layout, the structure of normalized markets, or the rules
+# deciding which CSV rows are accepted change, so stale caches are ignored
+MARKETS_CACHE_VERSION = 4
+
 # Login validation
 LOGIN_ALLOWED_CHARS = set(string.ascii_letters + string.digits + "_-")
 MIN_LOGIN_LEN = 3
@@ -51,6 +118,11 @@ RESERVED_LOGINS = {
     "test",
 }
 
+# Successful logins are remembered for this many seconds, so repeated logins
+# within a session skip the Argon2 verification.
+LOGIN_CACHE_TTL = 300
+LOGIN_CACHE_KEY = secrets.token_bytes(32)
+
 # Password validation
 MIN_PASSWORD_LEN = 8
 MAX_PASSWORD_LEN = 128
@@ -63,6 +135,32 @@ COMMON_PASSWORDS = {
     "password1",
 }
 
+# Closing bracket of a JSON list written by save_json_list(), preceded by
+# either the opening bracket (empty list) or the end of the last object.
+JSON_LIST_TAIL_RE = re.compile(rb"([\[}])\s*\]\s*\Z")
+
+# REPL tokenizer: bare words, key=value, key="quoted value" and key='quoted value'.
+# Lines it cannot consume completely (escapes, unbalanced quotes) go to shlex.
+TOKEN_RE = re.compile(
+    r"""
+    [ \t\r\n]*
+    (?:
+        ([^ \t\r\n"'\\=]*)=
+        (?:"([^"\\]*)"|'([^']*)'|([^ \t\r\n"'\\]*))
+        |([^ \t\r\n"'\\]+)
+    )
+    (?=[ \t\r\n]|$)
+    """,
+    re.VERBOSE,
+)
+
+# Market table: column headers, widths, and the row format built from them
+MARKET_HEADERS = ("ID", "NAME", "CITY", "STATE", "ZIP", "RATING", "DIST")
+MARKET_COLUMN_WIDTHS = (8, 50, 20, 16, 8, 10, 10)
+MARKET_ROW_TEMPLATE = (
+    " | ".join(f"{{:<{width}}}" for width in MARKET_COLUMN_WIDTHS) + "\n"
+)
+
 # Help text
 HELP = """
 Farmers Markets CLI
@@ -143,6 +241,29 @@ Farmers Markets CLI
   - review_delete удаляет только ваш собственный отзыв
 """
 
+HELP_BYTES = (HELP + "\n").encode("utf-8")
+
+EXIT_COMMANDS = frozenset({"exit", "quit", "q"})
+
+
+def read_json_file(path: Path) -> Any:
+    """Read and decode a UTF-8 JSON file.
+
+    With orjson installed the file is memory-mapped and parsed in place, without
+    first copying it into a bytes object. Otherwise the standard json module is used.
+    """
+    if orjson is None:
+        return json.loads(path.read_bytes())
+
+    with path.open("rb") as f:
+        # Empty files cannot be mapped; let orjson report them as invalid JSON.
+        if os.fstat(f.fileno()).st_size == 0:
+            return orjson.loads(b"")
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return orjson.loads(view)
+
 
 def load_json_list(path: Path, invalid_type_message: str) -> list[dict[str, Any]]:
     """Load a JSON file expected to contain a list.
@@ -155,7 +276,7 @@ def load_json_list(path: Path, invalid_type_message: str) -> list[dict[str, Any]
         path.write_text("[]\n", encoding="utf-8")
         return []
 
-    data = json.loads(path.read_text(encoding="utf-8"))
+    data = read_json_file(path)
     if not isinstance(data, list):
         raise ValueError(invalid_type_message)
 
@@ -178,11 +299,13 @@ def load_users(path: Path) -> list[dict[str, Any]]:
     )
 
 
+@lru_cache(maxsize=8192)
 def norm(s: str) -> str:
     """Normalize free-text input for case-insensitive comparison.
 
     Strip leading and trailing whitespace, collapse internal whitespace,
-    and convert the string to case-insensitive form.
+    and convert the string to case-insensitive form. Results are cached:
+    city and state names repeat across CSV rows and REPL filters.
     """
     return " ".join((s or "").strip().casefold().split())
 
@@ -192,46 +315,90 @@ def parse_float(value: str | None) -> float | None:
 
     Return None if the value is missing or cannot be converted.
     """
+    if not value:
+        return None
     try:
         return float(value)
     except (TypeError, ValueError):
         return None
 
 
-def normalize_market(row: dict[str, str]) -> Market:
-    """Convert a raw CSV row into a normalized market dictionary."""
+def normalize_market(fields: tuple[str, ...]) -> Market:
+    """Convert a raw CSV row into a normalized market dictionary.
+
+    fields holds the values of MARKET_CSV_COLUMNS taken from the row. Coordinates
+    are also stored in radians, together with the cosine of the latitude,
+    for distance calculations. State codes are interned: only a few dozen
+    distinct values are shared by thousands of rows.
+    """
+    fmid, name, city, state, zip_code, y, x = fields
+    name = name.strip()
+    city = city.strip()
+    state = sys.intern(state.strip())
+
+    lat = parse_float(y)
+    lon = parse_float(x)
+    lat_rad = lon_rad = cos_lat = None
+    if lat is not None and lon is not None:
+        lat_rad = radians(lat)
+        lon_rad = radians(lon)
+        cos_lat = cos(lat_rad)
+
     return {
-        "id": int(row["FMID"]),
-        "name": row["MarketName"].strip(),
-        "city": row["city"].strip(),
-        "state": row["State"].strip(),
-        "zip": row["zip"].strip(),
-        "lat": parse_float(row.get("y")),
-        "lon": parse_float(row.get("x")),
-        "city_norm": norm(row["city"]),
-        "state_norm": norm(row["State"]),
-        "name_norm": norm(row["MarketName"]),
-        "raw": row,
+        "id": int(fmid),
+        "name": name,
+        "city": city,
+        "state": state,
+        "zip": zip_code.strip(),
+        "lat": lat,
+        "lon": lon,
+        "lat_rad": lat_rad,
+        "lon_rad": lon_rad,
+        "cos_lat": cos_lat,
+        "city_norm": norm(city),
+        "state_norm": sys.intern(norm(state)),
+        "name_norm": norm(name),
     }
 
 
 def load_markets_csv(path: Path) -> Markets:
     """Load farmers markets from a CSV file.
 
-    Invalid rows are skipped. The returned dictionary is keyed by market ID.
+    Invalid rows (too short, or without a numeric FMID) are skipped.
+    The returned dictionary is keyed by market ID.
+    Raise ValueError if the header lacks any of MARKET_CSV_COLUMNS.
     """
     markets: Markets = {}
     skipped = 0
 
-    with path.open(encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
+    with path.open(encoding="utf-8", newline="", buffering=CSV_READ_BUFFER) as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        columns = {name: i for i, name in enumerate(header)}
+
+        missing = [name for name in MARKET_CSV_COLUMNS if name not in columns]
+        if missing:
+            raise ValueError(f"В CSV нет колонок: {', '.join(missing)}")
+        positions = [columns[name] for name in MARKET_CSV_COLUMNS]
+        get_fields = itemgetter(*positions)
+        min_row_len = max(positions) + 1
 
+        # Rows are validated with plain checks rather than by catching exceptions:
+        # short rows and rows without a numeric FMID are skipped.
         for row in reader:
-            try:
-                market = normalize_market(row)
-                markets[market["id"]] = market
-            except (KeyError, TypeError, ValueError):
+            if not row:
+                continue
+            if len(row) < min_row_len:
                 skipped += 1
+                continue
+
+            fields = get_fields(row)
+            if not fields[0].strip().isdecimal():
+                skipped += 1
+                continue
+
+            market = normalize_market(fields)
+            markets[market["id"]] = market
 
     if skipped:
         print(f"Предупреждение: пропущено строк CSV: {skipped}")
@@ -239,6 +406,139 @@ def load_markets_csv(path: Path) -> Markets:
     return markets
 
 
+def build_name_haystack(markets: list[Market]) -> tuple[str, list[int]]:
+    """Join normalized market names into one string for substring search.
+
+    Names are separated by NUL characters. The second element holds the offset
+    where each market's name starts, in the order of the markets list.
+    """
+    starts: list[int] = []
+    pos = 0
+    for market in markets:
+        starts.append(pos)
+        pos += len(market["name_norm"]) + 1
+
+    return "\0".join(m["name_norm"] for m in markets), starts
+
+
+def find_markets_by_name(
+    markets: list[Market], name_haystack: tuple[str, list[int]], needle: str
+) -> list[Market]:
+    """Return markets whose normalized name contains needle, in list order.
+
+    name_haystack is the result of build_name_haystack() for the same markets.
+    """
+    haystack, starts = name_haystack
+    if "\0" in needle:
+        return []
+
+    found: list[Market] = []
+    pos = haystack.find(needle)
+    while pos != -1:
+        i = bisect_right(starts, pos) - 1
+        found.append(markets[i])
+        if i + 1 == len(starts):
+            break
+        pos = haystack.find(needle, starts[i + 1])
+
+    return found
+
+
+def tokenize(line: str) -> list[tuple[str, str | None]] | None:
+    """Split a REPL line into (key, value) pairs with TOKEN_RE.
+
+    Bare words are returned as (word, None). Return None if the line uses
+    syntax the tokenizer does not handle, so the caller can fall back to shlex.
+    """
+    # Common case: no quoting at all. A printable line has no whitespace other
+    # than plain spaces, so str.split() splits exactly where shlex would.
+    if line.isprintable() and '"' not in line and "'" not in line and "\\" not in line:
+        return [
+            (k, v if sep else None)
+            for k, sep, v in (t.partition("=") for t in line.split())
+        ]
+
+    tokens: list[tuple[str, str | None]] = []
+    pos = 0
+
+    while pos < len(line):
+        match = TOKEN_RE.match(line, pos)
+        if match is None:
+            return None
+
+        if match.lastindex == 5:
+            tokens.append((match.group(5), None))
+        else:
+            tokens.append((match.group(1), match.group(match.lastindex)))
+        pos = match.end()
+
+    return tokens
+
+
+def load_markets(path: Path, cache_path: Path) -> Markets:
+    """Load farmers markets, using a pickled cache of the parsed CSV when possible.
+
+    The cache is used only if it was written with the current MARKETS_CACHE_VERSION
+    from a CSV file with exactly the same modification time and size. Otherwise
+    the CSV is parsed and the cache is rewritten.
+    """
+    stat = path.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    try:
+        version, cached_stamp, markets = pickle.loads(cache_path.read_bytes())
+        if version == MARKETS_CACHE_VERSION and tuple(cached_stamp) == stamp:
+            return markets
+    except Exception:
+        # A damaged cache can make pickle raise almost anything (AttributeError,
+        # OverflowError, MemoryError, ...); it is only a cache, so parse the CSV.
+        pass
+
+    markets = load_markets_csv(path)
+    save_markets_cache(cache_path, stamp, markets)
+    return markets
+
+
+def save_markets_cache(
+    cache_path: Path, stamp: tuple[int, int], markets: Markets
+) -> None:
+    """Write the markets cache atomically, tagged with the CSV (mtime_ns, size) stamp.
+
+    A failure to write the cache is not an error: the CSV is parsed again next time.
+    """
+    data = pickle.dumps(
+        (MARKETS_CACHE_VERSION, stamp, markets), pickle.HIGHEST_PROTOCOL
+    )
+    try:
+        tmp = tempfile.NamedTemporaryFile(
+            dir=cache_path.parent, prefix=cache_path.name, delete=False
+        )
+    except OSError:
+        return
+
+    try:
+        with tmp:
+            tmp.write(data)
+        os.replace(tmp.name, cache_path)
+    except OSError:
+        Path(tmp.name).unlink(missing_ok=True)
+
+
+def build_market_index(markets: list[Market]) -> dict[str, dict[str, list[Market]]]:
+    """Build lookup tables for the exact-match search filters.
+
+    Markets are grouped by normalized city, normalized state, and ZIP code,
+    keeping the original CSV order inside every group.
+    """
+    index: dict[str, dict[str, list[Market]]] = {"city": {}, "state": {}, "zip": {}}
+
+    for market in markets:
+        index["city"].setdefault(market["city_norm"], []).append(market)
+        index["state"].setdefault(market["state_norm"], []).append(market)
+        index["zip"].setdefault(market["zip"], []).append(market)
+
+    return index
+
+
 def parse_line(line: str) -> tuple[str, dict[str, str]] | None:
     """Parse a REPL input line into a command name and key-value arguments.
 
@@ -248,26 +548,62 @@ def parse_line(line: str) -> tuple[str, dict[str, str]] | None:
     if not line:
         return None
 
-    try:
-        parts = shlex.split(line)
-    except ValueError:
-        print("Ошибка: некорректный ввод. Проверьте кавычки.")
-        return None
-
-    cmd = parts[0].lower()
+    tokens = tokenize(line)
+    if tokens is None:
+        try:
+            parts = shlex.split(line)
+        except ValueError:
+            print("Ошибка: некорректный ввод. Проверьте кавычки.")
+            return None
+
+        tokens = []
+        for t in parts:
+            k, sep, v = t.partition("=")
+            tokens.append((k, v if sep else None))
+
+    # Commands and keys are usually typed in lower case already; lower() always
+    # builds a new string, so call it only when needed.
+    first, first_value = tokens[0]
+    cmd = first if first_value is None else f"{first}={first_value}"
+    if not cmd.islower():
+        cmd = cmd.lower()
     kwargs: dict[str, str] = {}
 
-    for t in parts[1:]:
-        if "=" in t:
-            k, v = t.split("=", 1)
-            kwargs[k.strip().lower()] = v.strip()
+    for k, v in tokens[1:]:
+        if v is not None:
+            k = k.strip()
+            kwargs[k if k.islower() else k.lower()] = v.strip()
 
     return cmd, kwargs
 
 
+def is_utf8_encoding(encoding: str | None) -> bool:
+    """Return True if encoding names UTF-8; unknown or missing names are not UTF-8."""
+    if not encoding:
+        return False
+    try:
+        return codecs.lookup(encoding).name == "utf-8"
+    except LookupError:
+        return False
+
+
 def cmd_help(_state: AppState, _kv: CommandArgs) -> None:
-    """Print the help message with available commands."""
-    print(HELP)
+    """Print the help message with available commands.
+
+    The pre-encoded HELP_BYTES are written to the binary buffer only when that is
+    exactly what print() would produce: stdout is UTF-8 and no newline
+    translation is needed. Otherwise fall back to print().
+    """
+    buffer = getattr(sys.stdout, "buffer", None)
+    if (
+        buffer is None
+        or os.linesep != "\n"
+        or not is_utf8_encoding(getattr(sys.stdout, "encoding", None))
+    ):
+        print(HELP)
+        return
+    sys.stdout.flush()
+    buffer.write(HELP_BYTES)
 
 
 def cmd_logout(state: AppState, kv: CommandArgs) -> None:
@@ -379,22 +715,94 @@ def verify_password(password: str, password_hash: str) -> bool:
         return False
 
 
+def password_hash_cost(parameters: Parameters | PasswordHasher) -> tuple[int, int]:
+    """Return a sort key approximating the cost of verifying an Argon2 hash."""
+    return parameters.time_cost * parameters.memory_cost, parameters.parallelism
+
+
+def costliest_password_hash(users: list[dict[str, Any]]) -> str | None:
+    """Return the stored password hash that is the most expensive to verify.
+
+    Return None if no stored hash is costlier than the current hasher profile.
+    Missing, non-string and unparsable hashes are ignored.
+    """
+    costliest = None
+    costliest_cost = password_hash_cost(ph)
+    for user in users:
+        password_hash = user.get("password_hash")
+        if not isinstance(password_hash, str):
+            continue
+        try:
+            cost = password_hash_cost(extract_parameters(password_hash))
+        except InvalidHashError:
+            continue
+        if cost > costliest_cost:
+            costliest, costliest_cost = password_hash, cost
+    return costliest
+
+
+def dummy_password_hash(users: list[dict[str, Any]], current: str | None = None) -> str:
+    """Return an Argon2 hash of a random password to verify unknown logins against.
+
+    It uses the parameters of the costliest stored hash (see
+    costliest_password_hash), so an unknown login takes as long as a wrong
+    password. It is built when users are loaded, not inside a login request;
+    current is returned unchanged if it already has those parameters.
+    """
+    template_hash = costliest_password_hash(users)
+    hasher = ph
+    if template_hash is not None:
+        hasher = PasswordHasher.from_parameters(extract_parameters(template_hash))
+    if current is not None and not hasher.check_needs_rehash(current):
+        return current
+    return hasher.hash(secrets.token_hex(16))
+
+
 def now_iso() -> str:
     """Return the current UTC time in ISO 8601 format with a trailing 'Z'."""
-    return (
-        datetime.now(timezone.utc)
-        .replace(microsecond=0)
-        .isoformat()
-        .replace("+00:00", "Z")
-    )
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def encode_json(data: Any) -> bytes:
+    """Encode data as UTF-8 JSON indented with two spaces.
+
+    orjson is used when it is installed, otherwise the standard json module.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
 
 
 def save_json_list(path: Path, data: list[dict[str, Any]]) -> None:
     """Save a list of dictionaries to a JSON file."""
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(
-        json.dumps(data, ensure_ascii=False, indent=2) + "\n", encoding="utf-8"
-    )
+    path.write_bytes(encode_json(data) + b"\n")
+
+
+def append_json_list(path: Path, data: list[dict[str, Any]]) -> None:
+    """Persist the last item of a list that was just appended to it.
+
+    Only the closing bracket of the JSON file is rewritten, so adding an item
+    does not depend on the file size. If the file does not end the way
+    save_json_list() writes it, the whole list is saved instead.
+    """
+    item = b"\n".join(b"  " + line for line in encode_json(data[-1]).split(b"\n"))
+    expected = b"[" if len(data) == 1 else b"}"
+
+    try:
+        with path.open("r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            start = f.seek(max(size - 64, 0))
+            match = JSON_LIST_TAIL_RE.search(f.read())
+            if match and match.group(1) == expected:
+                f.seek(start + match.end(1))
+                f.write((b"," if expected == b"}" else b"") + b"\n" + item + b"\n]\n")
+                f.truncate()
+                return
+    except FileNotFoundError:
+        pass
+
+    save_json_list(path, data)
 
 
 def cmd_register(state: AppState, kv: CommandArgs) -> None:
@@ -424,13 +832,12 @@ def cmd_register(state: AppState, kv: CommandArgs) -> None:
     login_norm = login.casefold()
     email_norm = email.casefold()
 
-    for u in state["users"]:
-        if u.get("login", "").casefold() == login_norm:
-            print("Ошибка: такой login уже занят.")
-            return
-        if u.get("email", "").casefold() == email_norm:
-            print("Ошибка: такой email уже зарегистрирован.")
-            return
+    if login_norm in state["users_by_login_norm"]:
+        print("Ошибка: такой login уже занят.")
+        return
+    if email_norm in state["users_by_email_norm"]:
+        print("Ошибка: такой email уже зарегистрирован.")
+        return
 
     errors = validate_password(password, login)
     if errors:
@@ -439,7 +846,7 @@ def cmd_register(state: AppState, kv: CommandArgs) -> None:
         return
 
     user = {
-        "id": max((int(u["id"]) for u in state["users"]), default=-1) + 1,
+        "id": state["next_user_id"],
         "email": email,
         "login": login,
         "password_hash": hash_password(password),
@@ -449,18 +856,37 @@ def cmd_register(state: AppState, kv: CommandArgs) -> None:
     }
 
     state["users"].append(user)
-    save_json_list(state["paths"]["users"], state["users"])
+    state["next_user_id"] += 1
+    state["users_by_login_norm"][login_norm] = user
+    state["users_by_email_norm"][email_norm] = user
+    state["users_by_id"][user["id"]] = user
+    append_json_list(state["paths"]["users"], state["users"])
     state["session"]["user"] = user
     print("Регистрация успешна. Вы вошли в аккаунт.")
 
 
-def find_user_by_login(users: list[User], login: str) -> User | None:
-    """Find and return a user by login, using case-insensitive comparison."""
-    login_norm = login.casefold()
+def build_user_index(users: list[User], field: str) -> dict[str, User]:
+    """Map casefolded values of a user field (login or email) to users.
+
+    If several users share the same value, the first one is kept.
+    """
+    index: dict[str, User] = {}
     for user in users:
-        if user.get("login", "").casefold() == login_norm:
-            return user
-    return None
+        index.setdefault(user.get(field, "").casefold(), user)
+    return index
+
+
+def build_users_by_id(users: list[User]) -> dict[Any, User]:
+    """Map user IDs to users. If an ID is repeated, the first user is kept."""
+    index: dict[Any, User] = {}
+    for user in users:
+        index.setdefault(user.get("id"), user)
+    return index
+
+
+def find_user_by_login(users_by_login: dict[str, User], login: str) -> User | None:
+    """Find and return a user by login, using case-insensitive comparison."""
+    return users_by_login.get(login.casefold())
 
 
 def cmd_login(state: AppState, kv: CommandArgs) -> None:
@@ -471,11 +897,33 @@ def cmd_login(state: AppState, kv: CommandArgs) -> None:
         print("Ошибка: login требует login=... password=...")
         return
 
-    user = find_user_by_login(state["users"], login)
-    if not user or not verify_password(password, user.get("password_hash", "")):
+    user = find_user_by_login(state["users_by_login_norm"], login)
+    if user is None:
+        verify_password(password, state["dummy_password_hash"])
         print("Неверный логин или пароль.")
         return
 
+    password_digest = hmac.digest(
+        LOGIN_CACHE_KEY, password.encode("utf-8"), hashlib.sha256
+    )
+    now = time.monotonic()
+    cache_key = (user.get("password_hash", ""), password_digest)
+    if state["login_cache"].get(cache_key, 0.0) < now:
+        if not verify_password(password, user.get("password_hash", "")):
+            print("Неверный логин или пароль.")
+            return
+
+        # Upgrade hashes created with other Argon2 parameters.
+        if ph.check_needs_rehash(user["password_hash"]):
+            user["password_hash"] = hash_password(password)
+            save_json_list(state["paths"]["users"], state["users"])
+            state["dummy_password_hash"] = dummy_password_hash(
+                state["users"], state["dummy_password_hash"]
+            )
+
+        cache_key = (user["password_hash"], password_digest)
+        state["login_cache"][cache_key] = now + LOGIN_CACHE_TTL
+
     state["session"]["user"] = user
     print("Вход выполнен.")
 
@@ -509,9 +957,11 @@ def parse_center(value: str | None) -> tuple[float, float] | None:
 def build_rating_stats(reviews: list[Review]) -> dict[int, dict[str, Any]]:
     """Build aggregated rating statistics for markets from the review list.
 
-    The result maps market IDs to dictionaries containing review count and average rating.
+    The result maps market IDs to dictionaries containing review count, rating sum,
+    and average rating. It is built once at startup and then kept up to date
+    with update_rating_stats().
     """
-    acc: dict[int, dict[str, Any]] = {}
+    stats: dict[int, dict[str, Any]] = {}
 
     for review in reviews:
         try:
@@ -520,179 +970,263 @@ def build_rating_stats(reviews: list[Review]) -> dict[int, dict[str, Any]]:
         except (KeyError, TypeError, ValueError):
             continue
 
-        item = acc.setdefault(market_id, {"count": 0, "sum": 0})
-        item["count"] += 1
-        item["sum"] += rating
+        update_rating_stats(stats, market_id, rating, 1)
+
+    return stats
+
+
+def update_rating_stats(
+    stats: dict[int, dict[str, Any]], market_id: int, rating: int, delta: int
+) -> None:
+    """Add (delta=1) or remove (delta=-1) a single rating in the aggregated statistics.
+
+    The entry of a market is dropped once its last review is removed.
+    """
+    item = stats.setdefault(market_id, {"count": 0, "sum": 0, "avg": None})
+    item["count"] += delta
+    item["sum"] += delta * rating
+
+    if item["count"] <= 0:
+        del stats[market_id]
+        return
+
+    item["avg"] = round(item["sum"] / item["count"], 2)
+
+
+def build_reviews_by_market(reviews: list[Review]) -> dict[int, list[Review]]:
+    """Group reviews by market ID, keeping their original order.
+
+    Reviews with a missing or invalid market ID are left out.
+    """
+    groups: dict[int, list[Review]] = {}
+
+    for review in reviews:
+        try:
+            market_id = int(review["market_id"])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        groups.setdefault(market_id, []).append(review)
 
-    result: dict[int, dict[str, Any]] = {}
-    for market_id, item in acc.items():
-        count = item["count"]
-        total = item["sum"]
-        result[market_id] = {
-            "count": count,
-            "avg": round(total / count, 2) if count else None,
-        }
+    return groups
 
-    return result
 
+def track_review(state: AppState, review: Review, delta: int) -> None:
+    """Add (delta=1) or remove (delta=-1) a review in the per-market review indexes.
 
-def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate the great-circle distance between two geographic points in kilometers."""
+    Keeps state["reviews_by_market"] and state["rating_stats"] in sync with
+    state["reviews"] without rebuilding them.
+    """
+    try:
+        market_id = int(review["market_id"])
+    except (KeyError, TypeError, ValueError):
+        return
+
+    market_reviews = state["reviews_by_market"].setdefault(market_id, [])
+    if delta > 0:
+        market_reviews.append(review)
+    else:
+        market_reviews.remove(review)
+        if not market_reviews:
+            del state["reviews_by_market"][market_id]
+
+    try:
+        rating = int(review["rating"])
+    except (KeyError, TypeError, ValueError):
+        return
+
+    update_rating_stats(state["rating_stats"], market_id, rating, delta)
+
+
+def market_distances(
+    markets: list[Market],
+    center: tuple[float, float],
+    radius: float | None = None,
+) -> dict[int, float]:
+    """Calculate great-circle distances in kilometers from a center point to markets.
+
+    Market coordinates are taken in radians as precomputed by normalize_market(),
+    and the center is converted once for the whole batch. Markets without
+    coordinates, or farther than the optional radius, are left out of the result.
+
+    With a radius, markets outside the bounding box of the search circle are
+    rejected before the haversine formula is evaluated.
+    """
     r = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
+    lat0 = radians(center[0])
+    lon0 = radians(center[1])
+    cos_lat0 = cos(lat0)
+    distances: dict[int, float] = {}
+
+    # Bounding box of the circle in radians; the margin covers distances that
+    # round down to the radius. Longitude is not limited if a pole is inside.
+    lat_min, lat_max, max_dlon = -pi, pi, pi
+    if radius is not None:
+        angle = (radius + 0.01) / r
+        lat_min, lat_max = lat0 - angle, lat0 + angle
+        if lat_min > -pi / 2 and lat_max < pi / 2:
+            max_dlon = asin(sin(angle) / cos_lat0)
+
+    for market in markets:
+        lat = market["lat_rad"]
+        if lat is None or lat < lat_min or lat > lat_max:
+            continue
 
-    a = (
-        sin(dlat / 2) ** 2
-        + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-    )
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return r * c
+        dlon = market["lon_rad"] - lon0
+        if max_dlon < pi and min(abs(dlon), 2 * pi - abs(dlon)) > max_dlon:
+            continue
+
+        dlat = lat - lat0
+        a = sin(dlat / 2) ** 2 + cos_lat0 * market["cos_lat"] * sin(dlon / 2) ** 2
+        c = 2 * atan2(sqrt(a), sqrt(1 - a))
+        distance = round(r * c, 2)
+        if radius is not None and distance > radius:
+            continue
+
+        distances[market["id"]] = distance
+
+    return distances
 
 
 def enrich_market(
     market: Market,
     rating_stats: dict[int, dict[str, Any]],
-    center: tuple[float, float] | None = None,
-) -> Market:
-    """Return a copy of a market enriched with rating and optional distance data."""
-    item = market.copy()
+    distances: dict[int, float] | None = None,
+) -> EnrichedMarket:
+    """Wrap a market together with its rating and optional distance data.
 
+    The market itself is referenced, not copied. Distances are looked up in
+    the mapping produced by market_distances().
+    """
     rs = rating_stats.get(market["id"], {"count": 0, "avg": None})
-    item["rating_count"] = rs["count"]
-    item["rating_avg"] = rs["avg"]
+    distance = distances.get(market["id"]) if distances else None
+    return EnrichedMarket(market, rs["count"], rs["avg"], distance)
 
-    item["distance"] = None
-    if center and item["lat"] is not None and item["lon"] is not None:
-        item["distance"] = round(
-            haversine_km(center[0], center[1], item["lat"], item["lon"]), 2
-        )
 
-    return item
+# Static sort orders: field name -> key function over a normalized market.
+SORT_KEYS: dict[str, Callable[[Market], tuple]] = {
+    "name": lambda m: (m["name_norm"], m["id"]),
+    "city": lambda m: (m["city_norm"], m["name_norm"], m["id"]),
+    "state": lambda m: (m["state_norm"], m["city_norm"], m["name_norm"], m["id"]),
+}
+
+
+def build_sort_ranks(markets: list[Market]) -> dict[str, dict[int, int]]:
+    """Precompute the position of every market in each static sort order.
+
+    The result maps a sort field to a dictionary of market ID -> rank, so
+    sorting later needs a single integer key per market.
+    """
+    return {
+        field: {m["id"]: rank for rank, m in enumerate(sorted(markets, key=key))}
+        for field, key in SORT_KEYS.items()
+    }
+
 
+def market_sort_key(
+    sort_by: str,
+    sort_ranks: dict[str, dict[int, int]],
+    rating_stats: dict[int, dict[str, Any]],
+    distances: dict[int, float] | None = None,
+) -> Callable[[Market], Any]:
+    """Return a key function that orders markets by the requested field.
 
-def sort_markets(items: list[Market], sort_by: str, order: str) -> list[Market]:
-    """Sort market items by the requested field and order."""
+    Unknown fields sort by name. Ties are broken by name and ID using the
+    precomputed ranks from build_sort_ranks().
+    """
     if sort_by not in {"name", "city", "state", "rating", "distance"}:
         sort_by = "name"
 
-    def key_name(x: Market):
-        return (x["name_norm"], x["id"])
-
-    def key_city(x: Market):
-        return (x["city_norm"], x["name_norm"], x["id"])
+    name_rank = sort_ranks["name"]
 
-    def key_state(x: Market):
-        return (x["state_norm"], x["city_norm"], x["name_norm"], x["id"])
+    def key_rank(x: Market):
+        return sort_ranks[sort_by][x["id"]]
 
     def key_rating(x: Market):
-        rating = x["rating_avg"]
+        rs = rating_stats.get(x["id"])
+        rating = rs["avg"] if rs else None
         has_rating = rating is not None
-        return (not has_rating, -(rating or 0), x["name_norm"], x["id"])
+        return (not has_rating, -(rating or 0), name_rank[x["id"]])
 
     def key_distance(x: Market):
-        distance = x["distance"]
+        distance = distances.get(x["id"]) if distances else None
         return (
             distance is None,
             distance if distance is not None else float("inf"),
-            x["name_norm"],
-            x["id"],
+            name_rank[x["id"]],
         )
 
     key_map = {
-        "name": key_name,
-        "city": key_city,
-        "state": key_state,
+        "name": key_rank,
+        "city": key_rank,
+        "state": key_rank,
         "rating": key_rating,
         "distance": key_distance,
     }
+    return key_map[sort_by]
 
-    reverse = order == "desc"
-    result = sorted(items, key=key_map[sort_by], reverse=reverse)
-    return result
 
+def select_page(
+    markets: list[Market],
+    key: Callable[[Market], Any],
+    order: str,
+    page: int,
+    size: int,
+) -> list[Market]:
+    """Return the markets of the requested page, sorted by key in the given order.
 
-def paginate(items: list[Market], page: int, size: int) -> tuple[list[Market], int]:
-    """Return a page slice of items together with the total item count."""
-    total = len(items)
-    start = (page - 1) * size
-    end = start + size
-    return items[start:end], total
+    Only the first page * size markets are ordered (with a heap), not the whole list.
+    """
+    end = page * size
+    select = heapq.nlargest if order == "desc" else heapq.nsmallest
+    return select(end, markets, key=key)[end - size :]
 
 
-def format_cell(value: Any, width: int) -> str:
-    """Format a value for fixed-width table output.
+def truncate(text: str, width: int) -> str:
+    """Shorten text to fit a fixed-width table column.
 
     Long values are truncated with an ellipsis.
     """
-    text = str(value)
     if len(text) <= width:
-        return text.ljust(width)
-    if width <= 1:
-        return text[:width]
+        return text
     return text[: width - 1] + "…"
 
 
-def print_markets(items: list[Market]) -> None:
-    """Print market items as a formatted table in the console."""
+def print_markets(items: list[EnrichedMarket]) -> None:
+    """Print market items as a formatted table in the console.
+
+    The whole table is formatted first and written with a single call.
+    """
     if not items:
         print("Ничего не найдено.")
         return
 
-    headers = {
-        "id": "ID",
-        "name": "NAME",
-        "city": "CITY",
-        "state": "STATE",
-        "zip": "ZIP",
-        "rating": "RATING",
-        "distance": "DIST",
-    }
-
-    widths = {
-        "id": 8,
-        "name": 50,
-        "city": 20,
-        "state": 16,
-        "zip": 8,
-        "rating": 10,
-        "distance": 10,
-    }
-
-    header_line = " | ".join(
-        [
-            format_cell(headers["id"], widths["id"]),
-            format_cell(headers["name"], widths["name"]),
-            format_cell(headers["city"], widths["city"]),
-            format_cell(headers["state"], widths["state"]),
-            format_cell(headers["zip"], widths["zip"]),
-            format_cell(headers["rating"], widths["rating"]),
-            format_cell(headers["distance"], widths["distance"]),
-        ]
-    )
-    print(header_line)
-    print("-" * len(header_line))
+    header_line = MARKET_ROW_TEMPLATE.format(*MARKET_HEADERS)
+    lines = [header_line, "-" * (len(header_line) - 1) + "\n"]
 
-    for m in items:
+    for item in items:
+        m = item.market
         rating_text = (
-            f"{m['rating_avg']} ({m['rating_count']})"
-            if m["rating_avg"] is not None
+            f"{item.rating_avg} ({item.rating_count})"
+            if item.rating_avg is not None
             else "нет"
         )
-        distance_text = f"{m['distance']} км" if m["distance"] is not None else "-"
-
-        row = " | ".join(
-            [
-                format_cell(m["id"], widths["id"]),
-                format_cell(m["name"], widths["name"]),
-                format_cell(m["city"], widths["city"]),
-                format_cell(m["state"], widths["state"]),
-                format_cell(m["zip"], widths["zip"]),
-                format_cell(rating_text, widths["rating"]),
-                format_cell(distance_text, widths["distance"]),
-            ]
+        distance_text = f"{item.distance} км" if item.distance is not None else "-"
+
+        values = (
+            str(m["id"]),
+            m["name"],
+            m["city"],
+            m["state"],
+            m["zip"],
+            rating_text,
+            distance_text,
         )
-        print(row)
+        lines.append(
+            MARKET_ROW_TEMPLATE.format(*map(truncate, values, MARKET_COLUMN_WIDTHS))
+        )
+
+    sys.stdout.write("".join(lines))
 
 
 def cmd_list(state: AppState, kv: CommandArgs) -> None:
@@ -707,14 +1241,21 @@ def cmd_list(state: AppState, kv: CommandArgs) -> None:
         print("Ошибка: sort=distance требует center=lat,lon")
         return
 
-    rating_stats = build_rating_stats(state["reviews"])
-    items = [enrich_market(m, rating_stats, center) for m in state["markets"]]
-    items = sort_markets(items, sort_by, order)
+    rating_stats = state["rating_stats"]
+    markets = state["markets"]
 
-    page_items, total = paginate(items, page, size)
+    # Distances of all markets are needed only to sort by them.
+    distances = None
+    if sort_by == "distance":
+        distances = market_distances(markets, center)
 
-    print(f"Всего рынков: {total}. Страница {page}, размер {size}.")
-    print_markets(page_items)
+    key = market_sort_key(sort_by, state["sort_ranks"], rating_stats, distances)
+    page_markets = select_page(markets, key, order, page, size)
+    if center is not None and distances is None:
+        distances = market_distances(page_markets, center)
+
+    print(f"Всего рынков: {len(markets)}. Страница {page}, размер {size}.")
+    print_markets([enrich_market(m, rating_stats, distances) for m in page_markets])
 
 
 def cmd_search(state: AppState, kv: CommandArgs) -> None:
@@ -749,10 +1290,23 @@ def cmd_search(state: AppState, kv: CommandArgs) -> None:
         print("Ошибка: sort=distance требует center=lat,lon")
         return
 
-    rating_stats = build_rating_stats(state["reviews"])
+    rating_stats = state["rating_stats"]
+
+    # Scan only the smallest group matching a filter, if any was given.
+    index = state["market_index"]
+    groups = [
+        index[field].get(value, [])
+        for field, value in (("city", city), ("state", state_q), ("zip", zip_q))
+        if value
+    ]
+    if name:
+        groups.append(
+            find_markets_by_name(state["markets"], state["name_haystack"], name)
+        )
+    markets = min(groups, key=len) if groups else state["markets"]
 
-    items = []
-    for market in state["markets"]:
+    candidates = []
+    for market in markets:
         if city and market["city_norm"] != city:
             continue
         if state_q and market["state_norm"] != state_q:
@@ -762,19 +1316,22 @@ def cmd_search(state: AppState, kv: CommandArgs) -> None:
         if name and name not in market["name_norm"]:
             continue
 
-        item = enrich_market(market, rating_stats, center)
+        candidates.append(market)
 
+    # Distances of all candidates are needed only to filter or sort by them.
+    distances = None
+    if radius is not None or sort_by == "distance":
+        distances = market_distances(candidates, center, radius)
         if radius is not None:
-            if item["distance"] is None or item["distance"] > radius:
-                continue
-
-        items.append(item)
+            candidates = [m for m in candidates if m["id"] in distances]
 
-    items = sort_markets(items, sort_by, order)
-    page_items, total = paginate(items, page, size)
+    key = market_sort_key(sort_by, state["sort_ranks"], rating_stats, distances)
+    page_markets = select_page(candidates, key, order, page, size)
+    if center is not None and distances is None:
+        distances = market_distances(page_markets, center)
 
-    print(f"Найдено рынков: {total}. Страница {page}, размер {size}.")
-    print_markets(page_items)
+    print(f"Найдено рынков: {len(candidates)}. Страница {page}, размер {size}.")
+    print_markets([enrich_market(m, rating_stats, distances) for m in page_markets])
 
 
 def cmd_show(state: AppState, kv: CommandArgs) -> None:
@@ -795,19 +1352,19 @@ def cmd_show(state: AppState, kv: CommandArgs) -> None:
         print("Рынок не найден.")
         return
 
-    rating_stats = build_rating_stats(state["reviews"])
+    rating_stats = state["rating_stats"]
     item = enrich_market(market, rating_stats)
 
-    print(f"ID: {item['id']}")
-    print(f"Название: {item['name']}")
-    print(f"Город: {item['city']}")
-    print(f"Штат: {item['state']}")
-    print(f"ZIP: {item['zip']}")
-    print(f"Координаты: {item['lat']}, {item['lon']}")
-    if item["rating_avg"] is None:
+    print(f"ID: {market['id']}")
+    print(f"Название: {market['name']}")
+    print(f"Город: {market['city']}")
+    print(f"Штат: {market['state']}")
+    print(f"ZIP: {market['zip']}")
+    print(f"Координаты: {market['lat']}, {market['lon']}")
+    if item.rating_avg is None:
         print("Рейтинг: нет отзывов")
     else:
-        print(f"Рейтинг: {item['rating_avg']} ({item['rating_count']} отзывов)")
+        print(f"Рейтинг: {item.rating_avg} ({item.rating_count} отзывов)")
 
 
 def cmd_reviews(state: AppState, kv: CommandArgs) -> None:
@@ -828,11 +1385,7 @@ def cmd_reviews(state: AppState, kv: CommandArgs) -> None:
         print("Рынок не найден.")
         return
 
-    market_reviews = [
-        review
-        for review in state["reviews"]
-        if int(review.get("market_id", -1)) == market_id
-    ]
+    market_reviews = state["reviews_by_market"].get(market_id, [])
 
     print(f"Отзывы для рынка: {market['name']} (ID: {market_id})")
 
@@ -840,9 +1393,11 @@ def cmd_reviews(state: AppState, kv: CommandArgs) -> None:
         print("Отзывов пока нет.")
         return
 
-    market_reviews.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+    market_reviews = sorted(
+        market_reviews, key=lambda x: x.get("created_at", ""), reverse=True
+    )
 
-    rating_stats = build_rating_stats(state["reviews"])
+    rating_stats = state["rating_stats"]
     stats = rating_stats.get(market_id, {"count": 0, "avg": None})
 
     if stats["avg"] is None:
@@ -858,10 +1413,7 @@ def cmd_reviews(state: AppState, kv: CommandArgs) -> None:
 
         if not login:
             user_id = review.get("user_id")
-            user = next(
-                (u for u in state["users"] if u.get("id") == user_id),
-                None,
-            )
+            user = state["users_by_id"].get(user_id)
             login = user.get("login") if user else f"user_id={user_id}"
 
         print(
@@ -909,7 +1461,7 @@ def cmd_review_add(state: AppState, kv: CommandArgs) -> None:
         return
 
     review = {
-        "id": max((int(r.get("id", -1)) for r in state["reviews"]), default=-1) + 1,
+        "id": state["next_review_id"],
         "market_id": market_id,
         "user_id": user["id"],
         "login": user["login"],
@@ -919,7 +1471,9 @@ def cmd_review_add(state: AppState, kv: CommandArgs) -> None:
     }
 
     state["reviews"].append(review)
-    save_json_list(state["paths"]["reviews"], state["reviews"])
+    state["next_review_id"] += 1
+    track_review(state, review, 1)
+    append_json_list(state["paths"]["reviews"], state["reviews"])
     print("Отзыв успешно добавлен.")
 
 
@@ -959,10 +1513,82 @@ def cmd_review_delete(state: AppState, kv: CommandArgs) -> None:
         return
 
     del state["reviews"][review_index]
+    track_review(state, review_to_delete, -1)
     save_json_list(state["paths"]["reviews"], state["reviews"])
     print("Отзыв удалён.")
 
 
+def load_market_state(path: Path, cache_path: Path) -> AppState:
+    """Load markets and build the indexes used by list, search and show."""
+    markets_by_id = load_markets(path, cache_path)
+    markets = list(markets_by_id.values())
+    return {
+        "markets_by_id": markets_by_id,
+        "markets": markets,
+        "market_index": build_market_index(markets),
+        "sort_ranks": build_sort_ranks(markets),
+        "name_haystack": build_name_haystack(markets),
+    }
+
+
+def next_record_id(records: list[dict[str, Any]]) -> int:
+    """Return the ID following the largest record ID, or 0 for an empty list.
+
+    Records with a missing or invalid ID are ignored.
+    """
+    max_id = -1
+    for record in records:
+        try:
+            max_id = max(max_id, int(record["id"]))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return max_id + 1
+
+
+def load_user_state(path: Path) -> AppState:
+    """Load users and build the lookup indexes used by register and login."""
+    users = load_users(path)
+    return {
+        "users": users,
+        "users_by_login_norm": build_user_index(users, "login"),
+        "users_by_email_norm": build_user_index(users, "email"),
+        "users_by_id": build_users_by_id(users),
+        "next_user_id": next_record_id(users),
+        "dummy_password_hash": dummy_password_hash(users),
+    }
+
+
+def load_review_state(path: Path) -> AppState:
+    """Load reviews and build the per-market review lists and rating stats."""
+    reviews = load_reviews(path)
+    return {
+        "reviews": reviews,
+        "reviews_by_market": build_reviews_by_market(reviews),
+        "next_review_id": next_record_id(reviews),
+        "rating_stats": build_rating_stats(reviews),
+    }
+
+
+def lazy_loaders(
+    groups: list[tuple[tuple[str, ...], Callable[[], AppState]]],
+) -> dict[str, Callable[[], AppState]]:
+    """Map every key of each (keys, loader) group to the group's loader."""
+    return {key: loader for keys, loader in groups for key in keys}
+
+
+def read_lines() -> Iterator[str]:
+    """Yield input lines, showing the prompt only on an interactive terminal.
+
+    Piped or redirected input is read straight from sys.stdin without a prompt.
+    """
+    if not sys.stdin.isatty():
+        for line in sys.stdin:
+            yield line.rstrip("\n")
+        return
+    while True:
+        yield input("\n> ")
+
+
 def run_repl(state: AppState) -> None:
     """Run the interactive REPL loop and dispatch commands to their handlers."""
     handlers: dict[str, Callable[[AppState, dict[str, str]], None]] = {
@@ -977,10 +1603,12 @@ def run_repl(state: AppState) -> None:
         "review_add": cmd_review_add,
         "review_delete": cmd_review_delete,
     }
+    get_handler = handlers.get
+    lines = read_lines()
     while True:
         try:
-            line = input("\n> ")
-        except (EOFError, KeyboardInterrupt):
+            line = next(lines)
+        except (StopIteration, EOFError, KeyboardInterrupt):
             print("\nВыход.")
             return
 
@@ -989,11 +1617,11 @@ def run_repl(state: AppState) -> None:
             continue
 
         cmd, kv = parsed
-        if cmd in {"exit", "quit", "q"}:
+        if cmd in EXIT_COMMANDS:
             print("Выход.")
             return
 
-        handler = handlers.get(cmd)
+        handler = get_handler(cmd)
         if not handler:
             print("Неизвестная команда. Введите: help")
             continue
@@ -1002,24 +1630,53 @@ def run_repl(state: AppState) -> None:
 
 
 def main() -> int:
-    """Initialize application state, print the welcome message, and start the REPL."""
-    markets_by_id = load_markets_csv(DATA_PATH)
-    users = load_users(USERS_PATH)
-    reviews = load_reviews(REVIEWS_PATH)
-
-    state: AppState = {
-        "paths": {
-            "data": DATA_PATH,
-            "users": USERS_PATH,
-            "reviews": REVIEWS_PATH,
+    """Initialize application state, print the welcome message, and start the REPL.
+
+    Markets, users and reviews are loaded lazily, on the first command that
+    needs them, so the prompt appears without waiting for file I/O.
+    """
+    loaders = lazy_loaders(
+        [
+            (
+                (
+                    "markets_by_id",
+                    "markets",
+                    "market_index",
+                    "sort_ranks",
+                    "name_haystack",
+                ),
+                partial(load_market_state, DATA_PATH, MARKETS_CACHE_PATH),
+            ),
+            (
+                (
+                    "users",
+                    "users_by_login_norm",
+                    "users_by_email_norm",
+                    "users_by_id",
+                    "next_user_id",
+                    "dummy_password_hash",
+                ),
+                partial(load_user_state, USERS_PATH),
+            ),
+            (
+                ("reviews", "reviews_by_market", "next_review_id", "rating_stats"),
+                partial(load_review_state, REVIEWS_PATH),
+            ),
+        ]
+    )
+    state: AppState = LazyState(
+        loaders,
+        {
+            "paths": {
+                "data": DATA_PATH,
+                "users": USERS_PATH,
+                "reviews": REVIEWS_PATH,
+            },
+            "session": {"user": None},
+            "login_cache": {},
+            "last_result_ids": [],
         },
-        "markets_by_id": markets_by_id,
-        "markets": list(markets_by_id.values()),
-        "users": users,
-        "reviews": reviews,
-        "session": {"user": None},
-        "last_result_ids": [],
-    }
+    )
 
     print("Farmers Markets CLI")
     print("Введите команду: help  (выход: exit)")